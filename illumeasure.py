@@ -7,16 +7,25 @@ Illuminance measurement with T-10A illuminance meter.
 
 import os
 import sys
+import signal
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import ftdi1 as ftdi
 import time
-from functools import reduce
+import bisect
+import struct
 
 
 
 class FtdiContext:
 
+  __slots__ = ("ftdi", "_write", "_read")
+
   vendorID = 0x0403
   productID = 0x6001
+  latencyTimerMs = 1 # Default of 16 ms delays every short reply, 2 ms is a safe fallback
+  chunkSize = 64 # One full-speed USB bulk packet, the T-10A messages are at most 32 bytes
+  readTimeoutS = 5 # How long readData waits for a complete message before giving up
   
   class FtdiContextException(Exception): pass
 
@@ -24,155 +33,247 @@ class FtdiContext:
     if ret < 0:
       raise self.FtdiContextException("ftdi.%s failed: %d (%s)" % (name, ret, ftdi.get_error_string(self.ftdi)))
 
-  def __init__(self):
+  def __init__(self, serial:str=None):
     self.ftdi = ftdi.new()
     if self.ftdi == 0:
       raise Exception('ftdi.new failed: %d' % ftdi.get_error_string(self.ftdi))
-    self.__assertFtdi("usb_open", ftdi.usb_open(self.ftdi, self.vendorID, self.productID))
-    self.__assertFtdi("setflowctrl", ftdi.setflowctrl(self.ftdi, ftdi.SIO_XON_XOFF_HS))
-    self.__assertFtdi("set_bitmode", ftdi.set_bitmode(self.ftdi, 0xff, ftdi.BITMODE_RESET))
-    self.__assertFtdi("set_baudrate", ftdi.set_baudrate(self.ftdi, 9600))
-    self.__assertFtdi("set_line_property", ftdi.set_line_property(self.ftdi, ftdi.BITS_7, ftdi.STOP_BIT_1, ftdi.EVEN))      
-
-  def writeData(self, data:str):
+    # __exit__ can't clean up after a failed __init__, so close (if opened) and free here before re-raising
+    opened = False
+    try:
+      if serial is None:
+        self.__assertFtdi("usb_open", ftdi.usb_open(self.ftdi, self.vendorID, self.productID))
+      else:
+        self.__assertFtdi("usb_open_desc", ftdi.usb_open_desc(self.ftdi, self.vendorID, self.productID, None, serial))
+      opened = True
+      self.__assertFtdi("setflowctrl", ftdi.setflowctrl(self.ftdi, ftdi.SIO_XON_XOFF_HS))
+      self.__assertFtdi("set_bitmode", ftdi.set_bitmode(self.ftdi, 0xff, ftdi.BITMODE_RESET))
+      self.__assertFtdi("set_baudrate", ftdi.set_baudrate(self.ftdi, 9600))
+      self.__assertFtdi("set_line_property", ftdi.set_line_property(self.ftdi, ftdi.BITS_7, ftdi.STOP_BIT_1, ftdi.EVEN))
+      self.__assertFtdi("set_latency_timer", ftdi.set_latency_timer(self.ftdi, self.latencyTimerMs))
+      self.__assertFtdi("write_data_set_chunksize", ftdi.write_data_set_chunksize(self.ftdi, self.chunkSize))
+      self.__assertFtdi("read_data_set_chunksize", ftdi.read_data_set_chunksize(self.ftdi, self.chunkSize))
+    except BaseException:
+      if opened:
+        ftdi.usb_close(self.ftdi)
+      ftdi.free(self.ftdi)
+      raise
+    # Bound once so the per-message write/read calls skip the module attribute lookups
+    self._write = ftdi.write_data
+    self._read = ftdi.read_data
+
+  def writeData(self, data:bytes):
     '''
     Writes data to device using the ftdi library. Returns the response from the device
     
-    :param data: String containing the data formatted as bytes
-    :type data: str
+    :param data: The raw message bytes
+    :type data: bytes
     '''
-    ret = ftdi.write_data(self.ftdi, data)
-    self.__assertFtdi("write_data", ret)
+    ret = self._write(self.ftdi, data)
+    if ret < 0:
+      raise self.FtdiContextException("ftdi.write_data failed: %d (%s)" % (ret, ftdi.get_error_string(self.ftdi)))
     return ret
 
   def readData(self, length:int):
     '''
-    Reads data from the device using the ftdi library. Returns the data in bytes
+    Reads data from the device using the ftdi library. Blocks until exactly length bytes have arrived or readTimeoutS has passed. Returns the data in bytes
     
     :param length: Length of the data as an integer
     :type length: int
     '''
-    ret, d = ftdi.read_data(self.ftdi, length)
-    self.__assertFtdi("read_data", ret)
-    return d
+    # ftdi.read_data returns whatever the chip has sent so far, which can be nothing or part of a message
+    received = b""
+    deadline = time.monotonic() + self.readTimeoutS
+    while True:
+      ret, d = self._read(self.ftdi, length - len(received))
+      if ret < 0:
+        raise self.FtdiContextException("ftdi.read_data failed: %d (%s)" % (ret, ftdi.get_error_string(self.ftdi)))
+      if ret > 0:
+        received += d[:ret]
+        if len(received) == length:
+          return received
+      if time.monotonic() > deadline:
+        raise self.FtdiContextException("ftdi.read_data timed out after %gs with %d of %d bytes received: %r" % (self.readTimeoutS, len(received), length, received))
   
   def endConnection(self):
     '''
-    Closes the connection to the device and cleans up.
+    Closes the connection to the device and cleans up. The ftdi context is freed even if closing fails.
     '''
-    self.__assertFtdi("usb_close", ftdi.usb_close(self.ftdi))
-    ftdi.free(self.ftdi)
+    try:
+      self.__assertFtdi("usb_close", ftdi.usb_close(self.ftdi))
+    finally:
+      ftdi.free(self.ftdi)
     print("Device closed")
 
+  def __enter__(self):
+    return self
+
+  def __exit__(self, excType, excValue, traceback):
+    if excType is None:
+      self.endConnection()
+      return
+    # Report a failed close instead of letting it replace the exception that is already in flight
+    try:
+      self.endConnection()
+    except self.FtdiContextException as e:
+      print(str(e), file=sys.stderr)
+
 
 
+# Scale factor for the exponent digit of a long format data field, keyed by the digit's byte value ('0' means 10**-4)
+_POW10_FROM_DIGIT = {ord("0") + d: 10**(d - 4) for d in range(10)}
+
+# Value of every two-digit hex BCC field in either case, so received BCCs are checked without parsing
+_HEX_PAIR = {bytes((h, l)): int(bytes((h, l)), 16) for h in b"0123456789ABCDEFabcdef" for l in b"0123456789ABCDEFabcdef"}
+
+# Receptor head, command, status and the three data fields of a long format message, starting after STX
+_LONG_FIELDS = struct.Struct("2s2s4s6s6s6s")
+
 # IlluminanceMeterT10A
 class Messenger:
 
+  __slots__ = ("ftdic", "debug")
+
   __messageLengthShort = 14
   __messageLengthLong = 32
 
   class BCCException(Exception): pass
+  class FramingError(Exception): pass
   class PowerOffError(Exception): pass
   class EEPROMError(Exception): pass
   class LowBatteryError(Exception): pass #TODO: consider discarding most recent measurement when this error is raised
   
-  def computeBcc(i:str):
+  @staticmethod
+  def computeBcc(data:bytes):
     '''
-    Computes result for the BCC Check by XORing the message bytes from start to end
+    Computes result for the BCC Check by XORing the message bytes from start to end. Returns the BCC as an integer
     
-    :param i: input bytes
-    :type i: str
+    :param data: input bytes
+    :type data: bytes
     '''
-    bytes = map(ord, i)
-    res = reduce(lambda x, y: x ^ y, bytes)
-    return "%02x" % res
+    # XOR the whole message as one wide integer, folding the upper half onto the lower half until a single byte is left
+    acc = int.from_bytes(data, "little")
+    width = len(data)
+    while width > 1:
+      width = (width + 1) // 2
+      acc = (acc >> (8 * width)) ^ (acc & ((1 << (8 * width)) - 1))
+    return acc
 
-  def messageEncodeShort(self, receptorHead:str, command:str, parameter:str):
+  @classmethod
+  def messageEncodeShort(cls, receptorHead:int, command:bytes, parameter:bytes):
     '''
     Encode a message using the short communication format
     
-    :param receptorHead: The number (formatted as a STRING) corresponding to an individual receptor head as set using the rotary switch
-    :type receptorHead: str
-    :param command: The command number (formatted as a STRING)
-    :type command: str
-    :param parameter: The 4-digit parameter code (formatted as a STRING)
-    :type parameter: str
-    '''
-    bccable = ("%02d" % receptorHead) + command + parameter + "\x03" # 0x03 for ETX
-    bccResult = self.computeBcc(bccable)
-    return "\x02" + bccable + bccResult + "\x0D\x0A" # \x02 for STX, \x0D for CR, \x0A for LF
-
-  def __assertBcc(self, bccable:str, actualBcc:str, i:str):
+    :param receptorHead: The integer number corresponding to an individual receptor head as set using the rotary switch
+    :type receptorHead: int
+    :param command: The 2-digit command number
+    :type command: bytes
+    :param parameter: The 4-digit parameter code
+    :type parameter: bytes
+    '''
+    buf = bytearray(cls.__messageLengthShort)
+    buf[0] = 0x02 # STX
+    buf[1:3] = b"%02d" % receptorHead
+    buf[3:5] = command
+    buf[5:9] = parameter
+    buf[9] = 0x03 # ETX
+    buf[10:12] = b"%02x" % cls.computeBcc(buf[1:10])
+    buf[12] = 0x0D # CR
+    buf[13] = 0x0A # LF
+    return bytes(buf) # the ftdi1 binding only accepts bytes, not bytearray
+
+  def __assertBcc(self, bccable:bytes, actualBcc:bytes, i:bytes):
     '''
     Carries out the BCC Check between the actual and expected BCC
     
     :param bccable: The portion of the message bytestring to be BCCed
-    :type bccable: str
+    :type bccable: bytes
     :param actualBcc: The actual BCC as sliced from the message
-    :type actualBcc: str
+    :type actualBcc: bytes
     :param i: The full message bytestring
-    :type i: str
+    :type i: bytes
     '''
     expectedBcc = self.computeBcc(bccable)
-    if int(actualBcc, 16) != int(expectedBcc, 16):
-      raise self.BCCException("BCC check failed, expected BCC '%s', got '%s', received '%s'." % (expectedBcc, actualBcc, i))
+    if _HEX_PAIR.get(actualBcc) != expectedBcc:
+      raise self.BCCException("BCC check failed, expected BCC '%02x', got '%s', received %r." % (expectedBcc, bytes(actualBcc).decode("ascii", "replace"), bytes(i).decode("ascii", "replace")))
+
+  def __assertFraming(self, i:bytes, length:int):
+    '''
+    Checks that a received message starts with STX and ends with ETX, BCC, CR and LF at the expected length, so a message read out of step with the device is reported as such
+    
+    :param i: The full message bytestring
+    :type i: bytes
+    :param length: The expected message length
+    :type length: int
+    '''
+    if len(i) != length or i[0] != 0x02 or i[length - 5] != 0x03 or i[length - 2:] != b"\x0D\x0A":
+      raise self.FramingError("Message out of frame, expected %d bytes from STX to CR LF, received %r." % (length, bytes(i).decode("ascii", "replace")))
 
-  def messageDecodeShort(self, i:str):
+  def messageDecodeShort(self, i:bytes):
     '''
     Decodes a message in the short communication format
     
     :param i: The message bytestring to be decoded
-    :type i: str
+    :type i: bytes
     '''
+    self.__assertFraming(i, self.__messageLengthShort)
     self.__assertBcc(i[1:10], i[10:12], i)
     receptorHead = int(i[1:3])
     command = i[3:5]
     parameter = i[5:9]
     return (receptorHead, command, parameter)
 
-  def messageDecodeLong(self, i:str):
+  def messageDecodeLong(self, i:bytes):
     '''
     Decodes a message in the long communication format
     
     :param i: The message bytestring to be decoded
-    :type i: str
+    :type i: bytes
     '''
     def dataToNumber(i):
-      if i == "      ":
+      if i == b"      ":
         return None
       else:
         v = int(i[1:5])
-        e = int(i[5]) - 4
-        r = v * (10**e)
-        return -r if i[0] == '-' else r
-    self.__assertBcc(i[1:28], i[28:30], i)
-    receptorHead = int(i[1:3])
-    command = i[3:5]
-    status = i[5:9]
-    data1 = dataToNumber(i[9:15])
-    data2 = dataToNumber(i[15:21])
-    data3 = dataToNumber(i[21:27])
-    return (receptorHead, command, status, (data1, data2, data3))
+        r = v * _POW10_FROM_DIGIT[i[5]]
+        return -r if i[0] == 0x2D else r # 0x2D for '-'
+    self.__assertFraming(i, self.__messageLengthLong)
+    mv = memoryview(i)
+    self.__assertBcc(mv[1:28], bytes(mv[28:30]), i)
+    receptorHead, command, status, data1, data2, data3 = _LONG_FIELDS.unpack_from(i, 1)
+    return (int(receptorHead), command, status, (dataToNumber(data1), dataToNumber(data2), dataToNumber(data3)))
 
-  def sendShort(self, receptorHeadNumber:str, command:str, parameter:str):
+  def sendShort(self, receptorHeadNumber:int, command:bytes, parameter:bytes):
     '''
     Send a message using the short communication format
     
-    :param receptorHeadNumber: The number (formatted as a STRING) corresponding to an individual receptor head as set using the rotary switch
-    :type receptorHeadNumber: str
-    :param command: The command number (formatted as a STRING)
-    :type command: str
-    :param parameter: The 4-digit parameter code (formatted as a STRING)
-    :type parameter: str
-    '''
-    encoded = self.messageEncodeShort(receptorHeadNumber, command, parameter)
+    :param receptorHeadNumber: The integer number corresponding to an individual receptor head as set using the rotary switch
+    :type receptorHeadNumber: int
+    :param command: The 2-digit command number
+    :type command: bytes
+    :param parameter: The 4-digit parameter code
+    :type parameter: bytes
+    '''
+    self.sendEncoded(self.messageEncodeShort(receptorHeadNumber, command, parameter))
+
+  def sendEncoded(self, encoded:bytes):
+    '''
+    Send a message that has already been encoded, e.g. one of the precomputed command constants
+    
+    :param encoded: The encoded message bytestring
+    :type encoded: bytes
+    '''
     ret = self.ftdic.writeData(encoded)
-    if ret < 0:
-      print('ftdi_write_data failed: %d (%s)' %
-            (ret, ftdi.get_error_string(self.ftdic)))
-    else:
-      print('ftdi_write_data wrote %d bytes' % ret)
+    self.__logWrite(ret)
+
+  def __logWrite(self, ret:int):
+    '''
+    Reports a completed write to the debug callback, if one is set
+    
+    :param ret: Number of bytes written as returned by the ftdi library
+    :type ret: int
+    '''
+    if self.debug is not None:
+      self.debug('ftdi_write_data wrote %d bytes' % ret)
   
   def checkStatus(self, decoded:tuple):
     '''
@@ -181,115 +282,159 @@ class Messenger:
     :param decoded: Decoded message
     :type decoded: tuple
     '''
-    status = str(decoded[2])
+    status = decoded[2]
 
     #Check for errors
-    errorCode = status[1]
-    if errorCode == " " or errorCode == "7":
+    errorCode = status[1:2]
+    if errorCode == b" " or errorCode == b"7":
       pass
-    elif errorCode == "1":
+    elif errorCode == b"1":
       raise self.PowerOffError("Receptor power head switched off, restart the T-10A")
-    elif errorCode == "2":
+    elif errorCode == b"2":
       raise self.EEPROMError("EEPROM error 1, restart the T-10A")
-    elif errorCode == "3":
+    elif errorCode == b"3":
       raise self.EEPROMError("EEPROM error 2, restart the T-10A")
-    elif errorCode == "5":
+    elif errorCode == b"5":
       raise ValueError("Measure value is over range")
     
     #Check battery level
-    battCode = status[3]
-    if battCode == "0" or battCode == "2":
+    battCode = status[3:4]
+    if battCode == b"0" or battCode == b"2":
       pass
-    elif battCode == "1" or battCode == "3":
+    elif battCode == b"1" or battCode == b"3":
       raise self.LowBatteryError("Low battery, change battery immediately and discard most recent measurement")
 
-  def receiveShort(self):
+  def receiveRawLong(self):
     '''
-    Receives a message from the device in the short communication format and checks for status updates. Returns the decoded message
+    Receives a message from the device in the long communication format without decoding it, so decoding can be deferred. Returns the message bytestring
     '''
-    encoded = self.ftdic.readData(self.__messageLengthShort)
-    decoded = self.messageDecodeShort(encoded)
+    return self.ftdic.readData(self.__messageLengthLong)
+
+  def decodeReceivedLong(self, received:bytes):
+    '''
+    Decodes a message received in the long communication format and checks for status updates. Returns the decoded message
+    
+    :param received: The message bytestring as returned by receiveRawLong
+    :type received: bytes
+    '''
+    decoded = self.messageDecodeLong(received)
     self.checkStatus(decoded)
     return decoded
 
-  def receiveLong(self):
+  def transceiveShort(self, encoded:bytes):
     '''
-    Receives a message from the device in the long communication format and checks for status updates. Returns the decoded message
+    Sends an encoded message and immediately reads the reply in the short communication format, with no work in between. Returns the decoded reply
+    
+    :param encoded: The encoded message bytestring
+    :type encoded: bytes
     '''
-    encoded = self.ftdic.readData(self.__messageLengthLong)
-    decoded =  self.messageDecodeLong(encoded)
+    ret = self.ftdic.writeData(encoded)
+    received = self.ftdic.readData(self.__messageLengthShort)
+    self.__logWrite(ret)
+    decoded = self.messageDecodeShort(received)
     self.checkStatus(decoded)
     return decoded
 
-  def __init__(self, ftdic:FtdiContext):
+  def __init__(self, ftdic:FtdiContext, debug=print):
     self.ftdic = ftdic
+    self.debug = debug # Called with diagnostic messages once an exchange has completed, set to None to silence
+
+
+
+# Commands whose wire bytes never change, encoded once at import
+_CMD_PC_CONNECTION_MODE = Messenger.messageEncodeShort(0, b"54", b"1   ")
+_CMD_HOLD_ON = Messenger.messageEncodeShort(99, b"55", b"1  0")
+_CMD_HOLD_OFF = Messenger.messageEncodeShort(99, b"55", b"0  0")
+_CMD_CLEAR_INTEGRATED_DATA = tuple(Messenger.messageEncodeShort(head, b"28", b"    ") for head in range(100)) # indexed by receptor head
+
+# Upper limits in lux of the manual measurement ranges, range code n covers up to _RANGE_LIMITS[n - 1]
+_RANGE_LIMITS = (29.99, 299.9, 2999, 29999, 299999)
+
+# Every command 10 frame, keyed by (hold, ccf, range code, receptor head)
+_CMD_READ_MEASUREMENT_DATA = {
+  (hold, ccf, rangeCode, head): Messenger.messageEncodeShort(head, b"10", (b"1" if hold else b"0") + (b"2" if ccf else b"3") + b"%d0" % rangeCode)
+  for hold in (False, True)
+  for ccf in (False, True)
+  for rangeCode in range(len(_RANGE_LIMITS) + 1)
+  for head in range(100)
+}
 
 
 
 class Protocol:
 
+  __slots__ = ("messenger", "filePrefix", "_csv_files")
+
   class ProtocolException(Exception): pass
 
   def switchToPcConnectionMode(self):
     '''
     Executes command 54 to set the T-10A to PC connection mode
     '''
-    self.messenger.sendShort("00", "54", "1   ")
-    responseActual = self.messenger.receiveShort()
-    responseExpected = ("00", "54", "    ")
+    responseActual = self.messenger.transceiveShort(_CMD_PC_CONNECTION_MODE)
+    responseExpected = (0, b"54", b"    ")
     if responseActual != responseExpected:
       raise self.ProtocolException('wrong PcConnectionMode response, expected "%s", got "%s".' % (responseExpected, responseActual))
-    time.sleep(0.5)
 
   def readMeasurementData(self, receptorHeadNumbers:tuple, hold:bool, ccf:bool, range):
     '''
     Executes command 10 to read measurement data or set the inital measurement conditions.
     
-    :param receptorHeadNumber: A tuple containing the integer numbers corresponding to each receptor head
-    :type receptorHeadNumber: tuple
+    :param receptorHeadNumbers: A tuple (or any other sequence, e.g. a numpy integer array) containing the integer numbers corresponding to each receptor head
+    :type receptorHeadNumbers: tuple
     :param hold: Set the HOLD function to HOLD (True) or RUN (False)
     :type hold: bool
     :param ccf: Toggle Colour Correction Factor (CCF) function ENABLED (True) or DISABLED (False)
     :type ccf: bool
     :param range: Set the range of the measurement. Use "auto" to switch to automatic mode or enter an integer / float value in lux for the upper limit of the measurement range.
     '''
-    if hold:
-      holdCode = "1"
+    if range == "auto":
+      rangeCode = 0
     else:
-      holdCode = "0"
+      limit = float(range)
+      if not 0 <= limit <= _RANGE_LIMITS[-1]:
+        raise ValueError("Error invalid range setting")
+      rangeCode = bisect.bisect_left(_RANGE_LIMITS, limit) + 1
+    
+    hold = bool(hold)
+    ccf = bool(ccf)
+    receptorHeadNumbers = [int(receptorHeadNumber) for receptorHeadNumber in receptorHeadNumbers]
+    for receptorHeadNumber in receptorHeadNumbers:
+      if not 0 <= receptorHeadNumber <= 99:
+        raise ValueError("Error invalid receptor head number")
+    requests = [(receptorHeadNumber, _CMD_READ_MEASUREMENT_DATA[(hold, ccf, rangeCode, receptorHeadNumber)]) for receptorHeadNumber in receptorHeadNumbers]
+    # All commands go out in a single write and the T-10A answers them in order, so the next heads are measuring while each reply is parsed.
+    # readData returns exactly one reply per call and each reply's framing is checked, so a reply can't be matched to the wrong head unnoticed
+    self.messenger.sendEncoded(b"".join(encoded for _, encoded in requests))
+    for receptorHeadNumber, _ in requests:
+      self.__recordMeasurement(receptorHeadNumber, self.messenger.receiveRawLong())
+
+  def __recordMeasurement(self, receptorHeadNumber:int, received:bytes):
+    '''
+    Decodes a command 10 reply and appends its data to the receptor head's CSV file
     
-    if ccf:
-      ccfCode = "2"
+    :param receptorHeadNumber: The integer number of the receptor head the command was sent to
+    :type receptorHeadNumber: int
+    :param received: The reply bytestring in the long communication format
+    :type received: bytes
+    '''
+    receivedMessage = self.messenger.decodeReceivedLong(received) #(receptorHead, command, status, (data1, data2, data3))
+    receivedData = receivedMessage[3]
+    if receivedMessage[0] == receptorHeadNumber:
+      self.__csvFile(receptorHeadNumber).write(f"{receivedData[0]}, {receivedData[1]}, {receivedData[2]}\n")
     else:
-      ccfCode = "3"
+      raise self.ProtocolException("Returned receptor head number did not match!")
 
+  def waitForMeasurement(self, range):
+    '''
+    Waits for the T-10A to settle after the measurement conditions have been set: 3s for automatic range and 1s for manual range
+    
+    :param range: The range setting passed to readMeasurementData, either "auto" or the upper limit of the measurement range in lux
+    '''
     if range == "auto":
-      rangeCode = "0"
+      time.sleep(3)
     else:
-      if float(range) >= 0 and float(range) <= 29.99:
-        rangeCode = "1"
-      elif float(range) > 29.99 and float(range) <= 299.9:
-        rangeCode = "2"
-      elif float(range) > 299.9 and float(range) <= 2999:
-        rangeCode = "3"
-      elif float(range) > 2999 and float(range) <= 29999:
-        rangeCode = "4"
-      elif float(range) > 29999 and float(range) <= 299999:
-        rangeCode = "5"
-      else:
-        raise ValueError("Error invalid range setting")
-    
-    for receptorHeadNumber in receptorHeadNumbers:
-      self.messenger.sendShort(f"{receptorHeadNumber:02d}", "10", holdCode + ccfCode + rangeCode + "0")
-      receivedMessage = self.messenger.receiveLong() #(receptorHead, command, status, (data1, data2, data3))
-      receivedData = receivedMessage[3]
-      if receivedMessage[0] == receptorHeadNumber:
-        with open(f"Receptor{receptorHeadNumber:02d}_data.csv", "a") as f:
-          f.write(f"{receivedData[0]}, {receivedData[1]}, {receivedData[2]}\n")
-      else:
-        raise self.ProtocolException("Returned receptor head number did not match!")
-      
-    time.sleep(0.5)
+      time.sleep(1)
     
   def setHoldStatus(self, hold:bool):
     '''
@@ -299,10 +444,10 @@ class Protocol:
     :type hold: bool
     '''
     if hold:
-      self.messenger.sendShort("99", "55", "1  0")
+      self.messenger.sendEncoded(_CMD_HOLD_ON)
     else:
-      self.messenger.sendShort("99", "55", "0  0")
-    time.sleep(0.5)
+      self.messenger.sendEncoded(_CMD_HOLD_OFF)
+    time.sleep(0.5) # Receptor head 99 addresses all heads and gets no reply, so there is nothing to wait on
   
   def clearPastIntegratedData(self, receptorHeadNumber:int): #TODO: Integrated data collection functions still WIP
     '''
@@ -311,34 +456,104 @@ class Protocol:
     :param receptorHeadNumber: The integer number corresponding to an individual receptor head as set using the rotary switch
     :type receptorHeadNumber: int
     '''
-    self.messenger.sendShort(f"{receptorHeadNumber:02d}", "28", "    ")
+    if not 0 <= receptorHeadNumber <= 99:
+      raise ValueError("Error invalid receptor head number")
+    self.messenger.sendEncoded(_CMD_CLEAR_INTEGRATED_DATA[receptorHeadNumber])
 
-  def __init__(self, messenger:Messenger):
+  def __csvFile(self, receptorHeadNumber:int):
+    '''
+    Returns the open CSV file for a receptor head, opening it on first use so it stays open for the whole session
+    
+    :param receptorHeadNumber: The integer number corresponding to an individual receptor head as set using the rotary switch
+    :type receptorHeadNumber: int
+    '''
+    f = self._csv_files.get(receptorHeadNumber)
+    if f is None:
+      f = open(f"{self.filePrefix}Receptor{receptorHeadNumber:02d}_data.csv", "a", buffering=1) # line buffered so each sample reaches disk without reopening the file
+      self._csv_files[receptorHeadNumber] = f
+    return f
+
+  def endSession(self):
+    '''
+    Closes the CSV files opened during the session.
+    '''
+    for f in self._csv_files.values():
+      f.close()
+    self._csv_files.clear()
+
+  def __init__(self, messenger:Messenger, filePrefix:str=""):
     self.messenger = messenger
+    self.filePrefix = filePrefix # Prepended to the CSV file names, keeps the data of several meters apart
+    self._csv_files = {}
 
 
 
-def main():
-  while True:
-    Ftdic = None
+def measurementCycle(serial:str=None):
+  '''
+  Opens one T-10A, takes a reading from its receptor heads and closes it again. Blocks until the cycle is done
+  
+  :param serial: Serial number of the FTDI adapter the T-10A is connected to, or None for the first one found
+  :type serial: str
+  '''
+  with FtdiContext(serial) as Ftdic: # a failed open cleans up inside FtdiContext, otherwise __exit__ closes and frees the device
+    messenger = Messenger(Ftdic)
+    protocol = Protocol(messenger, "" if serial is None else f"{serial}_")
+    receptors = (0,)
     try:
-      Ftdic = FtdiContext()
-      messenger = Messenger(Ftdic)
-      protocol = Protocol(messenger)
-      receptors = (0)
-
       protocol.switchToPcConnectionMode()
       #TODO: Clear send and receive buffers - how??
 
       protocol.readMeasurementData(receptors, hold=False, ccf=False, range="auto") # set measurement conditions
-      time.sleep(3) # 3s for Auto and 1s for Manual
+      protocol.waitForMeasurement("auto")
       protocol.readMeasurementData(receptors, hold=False, ccf=False, range="auto") # Take a measurement with the same settings. Loop command to take multiple measurments
+    finally:
+      protocol.endSession()
 
+async def pollMeter(serial:str, stop:asyncio.Event, executor:ThreadPoolExecutor):
+  '''
+  Repeats the measurement cycle on one meter until stop is set, backing off after a failed cycle without holding up the other meters
+  
+  :param serial: Serial number of the FTDI adapter, None selects the first one found
+  :type serial: str
+  :param stop: Set to end polling after the current cycle
+  :type stop: asyncio.Event
+  :param executor: Runs the blocking measurement cycles, with a worker for every meter
+  :type executor: ThreadPoolExecutor
+  '''
+  loop = asyncio.get_running_loop()
+  while not stop.is_set():
+    try:
+      await loop.run_in_executor(executor, measurementCycle, serial)
     except Exception as e:
-      print(str(e), file=sys.stderr)
-    finally:
-      Ftdic.endConnection()
-      time.sleep(15)
+      print(str(e) if serial is None else f"{serial}: {e}", file=sys.stderr)
+      # Back off before retrying on the event loop, so a failing meter doesn't hold a worker, and end early when stop is set
+      try:
+        await asyncio.wait_for(stop.wait(), 15)
+      except asyncio.TimeoutError:
+        pass
+
+async def pollMeters(serials:tuple):
+  '''
+  Polls every meter in its own task until Ctrl-C is pressed. The blocking libftdi calls run in worker threads so the meters are measured concurrently
+  
+  :param serials: Serial numbers of the FTDI adapters, None selects the first one found
+  :type serials: tuple
+  '''
+  loop = asyncio.get_running_loop()
+  stop = asyncio.Event()
+
+  def requestStop(signum, frame):
+    # Let the running cycles finish so the devices are closed cleanly. The cycles run in worker threads that
+    # can't be interrupted, so a KeyboardInterrupt would only wait for them too, further Ctrl-C presses are ignored
+    loop.call_soon_threadsafe(stop.set)
+
+  signal.signal(signal.SIGINT, requestStop)
+  with ThreadPoolExecutor(max_workers=len(serials)) as executor: # one worker per meter so no meter queues behind another
+    await asyncio.gather(*(pollMeter(serial, stop, executor) for serial in serials))
+
+def main():
+  serials = tuple(sys.argv[1:]) or (None,) # FTDI serial numbers of the meters to poll
+  asyncio.run(pollMeters(serials))
 
 
 